@@ -0,0 +1,235 @@
+import requests
+import threading
+import time
+import os
+import logging
+
+# Claude API endpoint
+CLAUDE_API_URL = "https://api.anthropic.com/v1/messages"
+
+# Retry and limiter settings (override via environment variables)
+MAX_RETRIES = int(os.environ.get("MAX_RETRIES", "3"))
+RETRY_DELAY = float(os.environ.get("RETRY_DELAY", "5"))  # seconds, base backoff
+MAX_BACKOFF = float(os.environ.get("CLAUDE_MAX_BACKOFF", "60"))  # seconds
+INITIAL_CONCURRENCY = int(os.environ.get("CLAUDE_INITIAL_CONCURRENCY", "2"))
+MAX_CONCURRENCY = int(os.environ.get("CLAUDE_MAX_CONCURRENCY", "4"))
+BREAKER_THRESHOLD = int(os.environ.get("CLAUDE_BREAKER_THRESHOLD", "5"))
+BREAKER_RESET_TIMEOUT = float(os.environ.get("CLAUDE_BREAKER_RESET_TIMEOUT", "60"))  # seconds
+
+# Anthropic signals load shedding with these error types / status codes
+OVERLOAD_ERROR_TYPES = ("overloaded_error", "rate_limit_error")
+OVERLOAD_STATUS_CODES = (429, 529)
+
+
+class ClaudeError(Exception):
+    """
+    Claude returned an error that retrying will not fix (bad request, auth, ...)
+    """
+
+
+class ClaudeUnavailable(ClaudeError):
+    """
+    Claude is overloaded or the circuit breaker is open; the job should be retried later
+    """
+
+
+class AdaptiveLimiter:
+    """
+    AIMD concurrency controller with a circuit breaker for requests to one Claude model.
+    There is one per model (see get_limiter), so an overloaded model doesn't hold back
+    requests that fall back to another one.
+
+    The number of requests allowed in flight grows by roughly one per window of
+    successful calls and is halved on every overload. Overloads and failures (network
+    errors, 5xx responses) also set a global backoff that every caller waits out, and after `failure_threshold` consecutive
+    failures the breaker opens and requests fail fast until `reset_timeout` passes.
+    One probe request is then let through (half-open) to decide whether to close it.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, initial_limit=INITIAL_CONCURRENCY, min_limit=1, max_limit=MAX_CONCURRENCY,
+                 decrease_factor=0.5, failure_threshold=BREAKER_THRESHOLD,
+                 reset_timeout=BREAKER_RESET_TIMEOUT, base_backoff=RETRY_DELAY, max_backoff=MAX_BACKOFF,
+                 name="Claude"):
+        self.name = name
+        self.min_limit = min_limit
+        self.max_limit = max(max_limit, min_limit)
+        self.limit = float(min(max(initial_limit, min_limit), self.max_limit))
+        self.decrease_factor = decrease_factor
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+
+        self.in_flight = 0
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.blocked_until = 0.0
+        self._cond = threading.Condition()
+
+    def _refresh_state(self, now):
+        # Move an expired open breaker to half-open so a probe can go through
+        if self.state == self.OPEN and now - self.opened_at >= self.reset_timeout:
+            self.state = self.HALF_OPEN
+            logging.info(f"{self.name} circuit breaker half-open, sending probe request")
+
+    def seconds_until_retry(self):
+        """
+        Return how long until the breaker allows a probe request (0 if it already does)
+        """
+        with self._cond:
+            if self.state != self.OPEN:
+                return 0.0
+            return max(0.0, self.opened_at + self.reset_timeout - time.monotonic())
+
+    def acquire(self):
+        """
+        Block until a request slot is free and any global backoff has passed.
+        Raises ClaudeUnavailable if the circuit breaker is open.
+        """
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                self._refresh_state(now)
+                if self.state == self.OPEN:
+                    raise ClaudeUnavailable(f"{self.name} circuit breaker is open")
+
+                allowed = 1 if self.state == self.HALF_OPEN else int(self.limit)
+                if now < self.blocked_until:
+                    self._cond.wait(self.blocked_until - now)
+                elif self.in_flight >= allowed:
+                    self._cond.wait()
+                else:
+                    self.in_flight += 1
+                    return
+
+    def release(self, outcome, retry_after=None):
+        """
+        Give back a slot and feed the outcome into the controller.
+        outcome is one of "success", "overload", "failure" or "error"; "error"
+        is a request-level problem that says nothing about API load.
+        """
+        with self._cond:
+            self.in_flight -= 1
+            now = time.monotonic()
+
+            if outcome == "success":
+                # Additive increase: about +1 per window of successful requests
+                self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+                self.consecutive_failures = 0
+                if self.state != self.CLOSED:
+                    logging.info(f"{self.name} circuit breaker closed")
+                self.state = self.CLOSED
+
+            elif outcome in ("overload", "failure"):
+                self.consecutive_failures += 1
+                # Global exponential backoff so the API gets time to recover before the next attempt
+                backoff = min(self.max_backoff, self.base_backoff * 2 ** (self.consecutive_failures - 1))
+                if retry_after:
+                    backoff = max(backoff, min(self.max_backoff, retry_after))
+                self.blocked_until = max(self.blocked_until, now + backoff)
+                if outcome == "overload":
+                    # Multiplicative decrease on top of the backoff
+                    self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+                    logging.warning(f"{self.name} overloaded. Concurrency limit now {int(self.limit)}, "
+                                    f"backing off {backoff:.0f}s")
+                else:
+                    logging.warning(f"{self.name} request failed, backing off {backoff:.0f}s")
+
+                if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                    if self.state != self.OPEN:
+                        logging.error(f"{self.name} circuit breaker open for {self.reset_timeout:.0f}s "
+                                      f"after {self.consecutive_failures} consecutive failures")
+                    self.state = self.OPEN
+                    self.opened_at = now
+
+            self._cond.notify_all()
+
+
+# One limiter per model, shared by every Claude call in the process
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(model):
+    """
+    Return the process-wide limiter for a model, creating it on first use
+    """
+    with _limiters_lock:
+        if model not in _limiters:
+            _limiters[model] = AdaptiveLimiter(name=model)
+        return _limiters[model]
+
+
+def seconds_until_retry():
+    """
+    Return how long until at least one model's breaker allows requests again
+    """
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    if not limiters:
+        return 0.0
+    return min(limiter.seconds_until_retry() for limiter in limiters)
+
+
+def _retry_after_seconds(response):
+    try:
+        return float(response.headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def call_claude_message(payload, api_key, timeout=120, max_retries=MAX_RETRIES):
+    """
+    Send a Messages API request through the model's limiter and return the full response
+    body (content and token usage). Overloads, network errors and 5xx responses are retried
+    with backoff up to max_retries times. Raises ClaudeUnavailable when Claude stays
+    unavailable or the breaker is open, and ClaudeError for any other API error.
+    """
+    limiter = get_limiter(payload["model"])
+    headers = {
+        "x-api-key": api_key,
+        "anthropic-version": "2023-06-01",
+        "content-type": "application/json"
+    }
+
+    for attempt in range(1, max_retries + 1):
+        limiter.acquire()
+        try:
+            response = requests.post(CLAUDE_API_URL, headers=headers, json=payload, timeout=timeout)
+        except requests.RequestException as e:
+            limiter.release("failure")
+            logging.warning(f"Exception calling Claude API (attempt {attempt}/{max_retries}): {str(e)}")
+            continue
+
+        try:
+            response_data = response.json()
+        except ValueError:
+            response_data = {}
+
+        # A 200 with no text block (empty content) is an error, not a result to index into
+        content = response_data.get('content') if response.status_code == 200 else None
+        if content and 'text' in content[0]:
+            limiter.release("success")
+            return response_data
+
+        error_type = response_data.get('error', {}).get('type')
+        if error_type in OVERLOAD_ERROR_TYPES or response.status_code in OVERLOAD_STATUS_CODES:
+            limiter.release("overload", retry_after=_retry_after_seconds(response))
+            logging.warning(f"Claude API overloaded. Retry {attempt}/{max_retries}")
+            continue
+
+        if response.status_code >= 500:
+            limiter.release("failure")
+            logging.warning(f"Claude API server error {response.status_code}. Retry {attempt}/{max_retries}")
+            continue
+
+        # Other errors - don't retry
+        limiter.release("error")
+        raise ClaudeError(f"Claude API error: {response_data or response.status_code}")
+
+    raise ClaudeUnavailable(f"Claude API still unavailable after {max_retries} attempts")
@@ -0,0 +1,345 @@
+import argparse
+import datetime
+import glob
+import time
+import uuid
+import os
+import logging
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from model_router import parse_budget
+from run_checkpoint import job_key, DELIVERED
+
+# Parquet archive of every scraped job, partitioned by month (archive/year=2025/month=3/...)
+ARCHIVE_DIR = os.environ.get("ARCHIVE_DIR", "job_archive")
+# Timezone used for hour/day/weekday grouping
+ARCHIVE_TIMEZONE = os.environ.get("ARCHIVE_TIMEZONE", "America/New_York")
+# Merge a month's per-run files into one once there are more than this many
+ARCHIVE_COMPACT_FILES = int(os.environ.get("ARCHIVE_COMPACT_FILES", "24"))
+
+SCHEMA = pa.schema([
+    ("archived_at", pa.timestamp("us", tz="UTC")),
+    ("run_key", pa.string()),
+    ("job_key", pa.string()),
+    ("search_url", pa.string()),
+    ("title", pa.string()),
+    ("link", pa.string()),
+    ("budget", pa.string()),
+    ("budget_value", pa.float64()),  # estimated project value in USD, see model_router.parse_budget
+    ("payment_type", pa.string()),
+    ("published_date", pa.string()),
+    ("skills", pa.list_(pa.string())),
+    ("description_chars", pa.int32()),
+    ("recent", pa.bool_()),  # passed the "posted in the last hour" filter
+    ("generated", pa.bool_()),
+    ("delivered", pa.bool_()),
+    ("flowchart", pa.bool_()),
+    ("description_tokens", pa.int32()),
+    ("prompt_description_tokens", pa.int32()),
+    ("flowchart_model", pa.string()),
+    ("proposal_model", pa.string()),
+    ("proposal_tier", pa.string()),
+    ("input_tokens", pa.int32()),
+    ("output_tokens", pa.int32()),
+    ("cost", pa.float64()),
+    ("latency", pa.float64()),
+])
+
+
+def _item_skills(item):
+    skills = []
+    i = 0
+    while f"skills/{i}" in item:
+        if item[f"skills/{i}"]:
+            skills.append(item[f"skills/{i}"])
+        i += 1
+    return skills
+
+
+def _usage_for(usage_log, task):
+    return next((usage for usage in usage_log if usage["task"] == task), {})
+
+
+def build_records(items, run_key, job_records, search_url="", archived_at=None):
+    """
+    Normalize scraped items plus their checkpointed state and generation metadata
+    (RunCheckpoint.job_records) into one row per job. Only jobs that passed the
+    last-hour filter are checkpointed, so every other item is archived as not recent.
+    """
+    archived_at = archived_at or datetime.datetime.now(datetime.timezone.utc)
+    records = []
+    for item in items:
+        key = job_key(item)
+        record = job_records.get(key)
+        metadata = record["metadata"] if record else None
+        usage_log = metadata["usage"] if metadata else []
+        flowchart_usage = _usage_for(usage_log, "flowchart")
+        proposal_usage = _usage_for(usage_log, "proposal")
+        records.append({
+            "archived_at": archived_at,
+            "run_key": run_key,
+            "job_key": key,
+            "search_url": item.get('searchUrl', search_url),
+            "title": item.get('title'),
+            "link": item.get('link'),
+            "budget": None if item.get('budget') is None else str(item.get('budget')),
+            "budget_value": parse_budget(item.get('budget'), item.get('paymentType')),
+            "payment_type": item.get('paymentType'),
+            "published_date": item.get('publishedDate'),
+            "skills": _item_skills(item),
+            "description_chars": len(item.get('shortBio') or ""),
+            "recent": record is not None,
+            "generated": bool(record and record["proposal"]),
+            "delivered": bool(record and record["state"] == DELIVERED),
+            "flowchart": bool(record and record["flowchart_url"]),
+            "description_tokens": metadata["description_tokens"] if metadata else None,
+            "prompt_description_tokens": metadata["prompt_description_tokens"] if metadata else None,
+            "flowchart_model": flowchart_usage.get("model"),
+            "proposal_model": proposal_usage.get("model"),
+            "proposal_tier": proposal_usage.get("tier"),
+            "input_tokens": sum(usage["input_tokens"] for usage in usage_log),
+            "output_tokens": sum(usage["output_tokens"] for usage in usage_log),
+            "cost": sum(usage["cost"] for usage in usage_log),
+            "latency": sum(usage["latency"] for usage in usage_log),
+        })
+    return records
+
+
+def _write_table(table, path):
+    # Write to a temp file first so a crash never leaves a half-written Parquet file
+    # (the "_" prefix keeps Arrow from picking up a leftover temp file when querying)
+    tmp_path = os.path.join(os.path.dirname(path), "_" + os.path.basename(path) + ".tmp")
+    pq.write_table(table, tmp_path, compression="zstd")
+    os.replace(tmp_path, path)
+
+
+def compact_partition(partition_dir):
+    """
+    Merge a partition's Parquet files into one, dropping duplicate (run_key, job_key)
+    rows left by resumed runs. Keeps the query side down to a few files per month.
+    """
+    paths = sorted(glob.glob(os.path.join(partition_dir, "*.parquet")))
+    if len(paths) <= 1:
+        return
+    table = pa.concat_tables([pq.read_table(path, schema=SCHEMA) for path in paths])
+
+    # Keep the last row written for each run/job pair
+    table = table.append_column("_row", pa.array(range(table.num_rows), pa.int64()))
+    latest = table.group_by(["run_key", "job_key"]).aggregate([("_row", "max")])["_row_max"]
+    table = table.take(pc.take(latest, pc.sort_indices(latest))).drop_columns(["_row"])
+
+    _write_table(table, os.path.join(partition_dir, f"compacted-{uuid.uuid4().hex}.parquet"))
+    for path in paths:
+        os.remove(path)
+    logging.info(f"Compacted {len(paths)} archive files in {partition_dir}")
+
+
+def archive_run(items, run_key, job_records, search_url="", archive_dir=ARCHIVE_DIR):
+    """
+    Append this run's jobs to the archive as one Parquet file in the current month's
+    partition. A resumed run overwrites the file written by its earlier attempt; since
+    job_records covers every attempt, nothing the earlier attempt did is lost.
+    """
+    if not items:
+        return None
+    records = build_records(items, run_key, job_records, search_url)
+    table = pa.Table.from_pylist(records, schema=SCHEMA)
+
+    now = records[0]["archived_at"]
+    partition_dir = os.path.join(archive_dir, f"year={now.year}", f"month={now.month}")
+    os.makedirs(partition_dir, exist_ok=True)
+    path = os.path.join(partition_dir, f"run-{run_key}.parquet")
+    _write_table(table, path)
+    logging.info(f"Archived {table.num_rows} jobs to {path}")
+
+    if len(glob.glob(os.path.join(partition_dir, "*.parquet"))) > ARCHIVE_COMPACT_FILES:
+        compact_partition(partition_dir)
+    return path
+
+
+# ========================
+# Query CLI
+# ========================
+
+def load_jobs(archive_dir=ARCHIVE_DIR, since=None, until=None, recent_only=False, columns=None):
+    """
+    Load archived jobs as an Arrow table, pruning month partitions outside the date range
+    """
+    if not glob.glob(os.path.join(archive_dir, "year=*", "month=*", "*.parquet")):
+        return pa.Table.from_pylist([], schema=SCHEMA)
+    schema = SCHEMA.append(pa.field("year", pa.int32())).append(pa.field("month", pa.int32()))
+    dataset = ds.dataset(archive_dir, format="parquet", schema=schema, partitioning="hive")
+
+    # Partition conditions let Arrow skip whole months without opening their files
+    conditions = []
+    if since:
+        conditions.append((ds.field("year") > since.year) | ((ds.field("year") == since.year) & (ds.field("month") >= since.month)))
+        conditions.append(ds.field("archived_at") >= pa.scalar(since, pa.timestamp("us", tz="UTC")))
+    if until:
+        conditions.append((ds.field("year") < until.year) | ((ds.field("year") == until.year) & (ds.field("month") <= until.month)))
+        conditions.append(ds.field("archived_at") < pa.scalar(until, pa.timestamp("us", tz="UTC")))
+    if recent_only:
+        conditions.append(ds.field("recent"))
+
+    expression = None
+    for condition in conditions:
+        expression = condition if expression is None else expression & condition
+    return dataset.to_table(columns=columns, filter=expression)
+
+
+def _add_time_columns(table):
+    local = table["archived_at"].cast(pa.timestamp("us", tz=ARCHIVE_TIMEZONE))
+    return (table
+            .append_column("hour", pc.hour(local))
+            .append_column("weekday", pc.day_of_week(local))  # Monday = 0
+            .append_column("day", pc.strftime(local, format="%Y-%m-%d"))
+            .append_column("month_label", pc.strftime(local, format="%Y-%m")))
+
+
+GROUP_COLUMNS = {
+    "hour": "hour",
+    "weekday": "weekday",
+    "day": "day",
+    "month": "month_label",
+    "search": "search_url",
+    "model": "proposal_model",
+}
+
+WEEKDAYS = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+
+
+def _print_table(table, elapsed):
+    rows = table.to_pylist()
+    names = table.column_names
+    formatted = [[_format_value(name, row[name]) for name in names] for row in rows]
+    widths = [max([len(name)] + [len(values[i]) for values in formatted]) for i, name in enumerate(names)]
+    print("  ".join(name.ljust(width) for name, width in zip(names, widths)))
+    for values in formatted:
+        print("  ".join(value.ljust(width) for value, width in zip(values, widths)))
+    print(f"\n{len(rows)} rows in {elapsed * 1000:.0f} ms")
+
+
+def _format_value(name, value):
+    if value is None:
+        return "-"
+    if name == "weekday":
+        return WEEKDAYS[value]
+    if isinstance(value, float):
+        return f"{value:.4f}" if "cost" in name else f"{value:.1f}"
+    return str(value)
+
+
+# Friendlier names for the aggregate columns Arrow produces
+COLUMN_LABELS = {
+    "job_key_count": "jobs",
+    "recent_sum": "recent",
+    "delivered_sum": "delivered",
+    "flowchart_sum": "flowcharts",
+    "budget_value_count": "jobs",
+    "budget_value_mean": "mean_budget",
+    "budget_value_approximate_median": "median_budget",
+    "budget_value_max": "max_budget",
+    "input_tokens_sum": "input_tokens",
+    "output_tokens_sum": "output_tokens",
+    "description_tokens_mean": "avg_description_tokens",
+    "prompt_description_tokens_mean": "avg_prompt_tokens",
+    "latency_mean": "avg_latency",
+    "cost_sum": "cost",
+}
+
+
+def _finish_groups(table, by):
+    names = [by if name == GROUP_COLUMNS[by] else COLUMN_LABELS.get(name, name) for name in table.column_names]
+    return table.rename_columns(names).sort_by(by)
+
+
+def query_count(table, by):
+    table = table.group_by(GROUP_COLUMNS[by]).aggregate([
+        ("job_key", "count"),
+        ("recent", "sum"),
+        ("delivered", "sum"),
+    ])
+    return _finish_groups(table, by)
+
+
+def query_skills(table, top, hour=None):
+    if hour is not None:
+        table = table.filter(pc.equal(table["hour"], hour))
+    counts = pc.value_counts(pc.list_flatten(table["skills"]))
+    result = pa.table({"skill": counts.field("values"), "jobs": counts.field("counts")})
+    return result.sort_by([("jobs", "descending")]).slice(0, top)
+
+
+def query_budgets(table, by):
+    table = table.filter(pc.is_valid(table["budget_value"]))
+    table = table.group_by(GROUP_COLUMNS[by]).aggregate([
+        ("budget_value", "count"),
+        ("budget_value", "mean"),
+        ("budget_value", "approximate_median"),
+        ("budget_value", "max"),
+    ])
+    return _finish_groups(table, by)
+
+
+def query_generation(table, by):
+    table = table.filter(table["generated"])
+    table = table.group_by(GROUP_COLUMNS[by]).aggregate([
+        ("job_key", "count"),
+        ("delivered", "sum"),
+        ("flowchart", "sum"),
+        ("input_tokens", "sum"),
+        ("output_tokens", "sum"),
+        ("description_tokens", "mean"),
+        ("prompt_description_tokens", "mean"),
+        ("latency", "mean"),
+        ("cost", "sum"),
+    ])
+    return _finish_groups(table, by)
+
+
+def _parse_date(value):
+    return datetime.datetime.strptime(value, "%Y-%m-%d").replace(tzinfo=datetime.timezone.utc)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Query the archive of scraped Upwork jobs")
+    parser.add_argument("--archive-dir", default=ARCHIVE_DIR)
+    parser.add_argument("--since", type=_parse_date, help="first day to include (YYYY-MM-DD, UTC)")
+    parser.add_argument("--until", type=_parse_date, help="first day to exclude (YYYY-MM-DD, UTC)")
+    parser.add_argument("--recent-only", action="store_true", help="only jobs posted within the last hour when scraped")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    count = commands.add_parser("count", help="jobs seen, recent and delivered per group")
+    count.add_argument("--by", choices=["hour", "weekday", "day", "month", "search"], default="day")
+
+    skills = commands.add_parser("skills", help="most common skills")
+    skills.add_argument("--hour", type=int, help=f"only jobs scraped at this hour ({ARCHIVE_TIMEZONE})")
+    skills.add_argument("--top", type=int, default=20)
+
+    budgets = commands.add_parser("budgets", help="budget statistics per group")
+    budgets.add_argument("--by", choices=["hour", "weekday", "month", "search"], default="hour")
+
+    generation = commands.add_parser("generation", help="tokens, latency, cost and deliveries per group")
+    generation.add_argument("--by", choices=["day", "month", "model"], default="day")
+
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    table = _add_time_columns(load_jobs(args.archive_dir, args.since, args.until, args.recent_only))
+    if args.command == "count":
+        result = query_count(table, args.by)
+    elif args.command == "skills":
+        result = query_skills(table, args.top, args.hour)
+    elif args.command == "budgets":
+        result = query_budgets(table, args.by)
+    else:
+        result = query_generation(table, args.by)
+    _print_table(result, time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,14 @@
 import requests
-import time
 import os
 import logging
 import json
 import re
 
+from claude_client import ClaudeError, ClaudeUnavailable
+from model_router import call_routed, log_tier_stats
+from prompt_compaction import prepare_description
+from telegram_render import pack_messages, split_text, escape, escape_attr, html_to_text, MESSAGE_LIMIT
+
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
@@ -44,9 +48,6 @@ def generate_mermaid_flowchart(job_title, job_description, skills_list=None):
     if skills_list is None:
         skills_list = []
     
-    # Claude API endpoint
-    url = "https://api.anthropic.com/v1/messages"
-    
     # Construct a prompt that asks Claude to generate a Mermaid.js flowchart
     prompt = f"""
     Create a professional Mermaid.js flowchart diagram showing our implementation approach for this job:
@@ -102,68 +103,27 @@ def generate_mermaid_flowchart(job_title, job_description, skills_list=None):
     ONLY return the Mermaid.js code, nothing else. No explanations or additional text.
     """
     
-    # Set up request headers and payload for Claude API
-    headers = {
-        "x-api-key": CLAUDE_API_KEY,
-        "anthropic-version": "2023-06-01",
-        "content-type": "application/json"
-    }
+    # The router picks the model tier and falls back on overload; ClaudeUnavailable propagates to the caller
+    try:
+        mermaid_code, _ = call_routed("flowchart", prompt, CLAUDE_API_KEY, description=job_description)
+    except ClaudeUnavailable:
+        raise
+    except ClaudeError as e:
+        logging.error(f"Failed to generate Mermaid flowchart: {str(e)}")
+        return None, None
     
-    payload = {
-        "model": "claude-3-5-sonnet-20240620",
-        "max_tokens": 1500,
-        "messages": [
-            {"role": "user", "content": prompt}
-        ]
-    }
+    # Clean up the response to extract just the Mermaid code
+    # Remove any markdown code block syntax if present
+    mermaid_code = re.sub(r'```mermaid\s*', '', mermaid_code)
+    mermaid_code = re.sub(r'```\s*$', '', mermaid_code)
+    mermaid_code = mermaid_code.strip()
     
-    # Retry settings
-    max_retries = 3
-    retry_delay = 5  # seconds
-    current_retry = 0
-    
-    while current_retry < max_retries:
-        try:
-            # Make the API call to Claude
-            response = requests.post(url, headers=headers, json=payload)
-            response_data = response.json()
-            
-            # Check for successful response
-            if response.status_code == 200 and 'content' in response_data:
-                mermaid_code = response_data['content'][0]['text']
-                
-                # Clean up the response to extract just the Mermaid code
-                # Remove any markdown code block syntax if present
-                mermaid_code = re.sub(r'```mermaid\s*', '', mermaid_code)
-                mermaid_code = re.sub(r'```\s*$', '', mermaid_code)
-                mermaid_code = mermaid_code.strip()
-                
-                logging.info("Successfully generated custom Mermaid flowchart")
-                
-                # Create a shareable URL using Mermaid Live Editor
-                mermaid_live_url = create_mermaid_live_url(mermaid_code)
-                
-                return mermaid_code, mermaid_live_url
-            
-            # Check specifically for overloaded error
-            elif response_data.get('error', {}).get('type') == 'overloaded_error':
-                current_retry += 1
-                wait_time = retry_delay * current_retry
-                logging.warning(f"Claude API overloaded. Retry {current_retry}/{max_retries} after {wait_time}s")
-                time.sleep(wait_time)
-                continue
-            
-            # Other errors - don't retry
-            else:
-                logging.error(f"Failed to generate Mermaid flowchart: {response_data}")
-                return None, None
-                
-        except Exception as e:
-            logging.error(f"Exception calling Claude API: {str(e)}")
-            return None, None
-    
-    # If we've exhausted all retries
-    return None, None
+    logging.info("Successfully generated custom Mermaid flowchart")
+    
+    # Create a shareable URL using Mermaid Live Editor
+    mermaid_live_url = create_mermaid_live_url(mermaid_code)
+    
+    return mermaid_code, mermaid_live_url
 
 def create_mermaid_live_url(mermaid_code):
     """
@@ -202,9 +162,6 @@ def generate_proposal_with_claude(job_title, job_description, skills_list=None,
     if budget is None:
         budget = "Not specified"
     
-    # Claude API endpoint
-    url = "https://api.anthropic.com/v1/messages"
-    
     # Add flowchart information to the prompt if available
     flowchart_info = ""
     if flowchart_url:
@@ -249,57 +206,17 @@ def generate_proposal_with_claude(job_title, job_description, skills_list=None,
     Let them know that they will have a team of skilled developers on the project.
     """
     
-    # Set up request headers and payload for Claude API
-    headers = {
-        "x-api-key": CLAUDE_API_KEY,
-        "anthropic-version": "2023-06-01",
-        "content-type": "application/json"
-    }
-    
-    payload = {
-        "model": "claude-3-5-sonnet-20240620",
-        "max_tokens": 1000,
-        "messages": [
-            {"role": "user", "content": prompt}
-        ]
-    }
-    
-    # Retry settings
-    max_retries = 3
-    retry_delay = 5  # seconds
-    current_retry = 0
-    
-    while current_retry < max_retries:
-        try:
-            # Make the API call to Claude
-            response = requests.post(url, headers=headers, json=payload)
-            response_data = response.json()
-            
-            # Check for successful response
-            if response.status_code == 200 and 'content' in response_data:
-                proposal_text = response_data['content'][0]['text']
-                logging.info("Successfully generated proposal with Claude")
-                return proposal_text
-            
-            # Check specifically for overloaded error
-            elif response_data.get('error', {}).get('type') == 'overloaded_error':
-                current_retry += 1
-                wait_time = retry_delay * current_retry
-                logging.warning(f"Claude API overloaded. Retry {current_retry}/{max_retries} after {wait_time}s")
-                time.sleep(wait_time)
-                continue
-            
-            # Other errors - don't retry
-            else:
-                logging.error(f"Failed to generate proposal: {response_data}")
-                return f"Unable to generate proposal due to API error. Please check logs."
-                
-        except Exception as e:
-            logging.error(f"Exception calling Claude API: {str(e)}")
-            return f"Error calling Claude API: {str(e)}"
-    
-    # If we've exhausted all retries
-    return "Could not generate proposal after multiple attempts. Claude API may be experiencing high traffic."
+    # The router picks the model tier and falls back on overload; ClaudeUnavailable propagates to the caller
+    try:
+        proposal_text, _ = call_routed("proposal", prompt, CLAUDE_API_KEY, budget=budget, description=job_description)
+    except ClaudeUnavailable:
+        raise
+    except ClaudeError as e:
+        logging.error(f"Failed to generate proposal: {str(e)}")
+        return "Unable to generate proposal due to API error. Please check logs."
+    
+    logging.info("Successfully generated proposal with Claude")
+    return proposal_text
 
 def send_telegram_message(message):
     url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
@@ -312,6 +229,16 @@ def send_telegram_message(message):
     try:
         response = requests.post(url, data=payload)
         result = response.json()
+        # Don't lose the message if Telegram can't parse it as HTML: resend as plain text
+        if not result.get('ok') and "can't parse entities" in result.get('description', ''):
+            logging.warning(f"Telegram could not parse HTML, resending as plain text: {result}")
+            del payload["parse_mode"]
+            for chunk in split_text(html_to_text(message), MESSAGE_LIMIT):
+                payload["text"] = chunk
+                response = requests.post(url, data=payload)
+                result = response.json()
+                if not result.get('ok'):
+                    break
         if not result.get('ok'):
             logging.error(f"Telegram error: {result}")
         return result
@@ -336,33 +263,41 @@ def process_job():
         if skill.lower() in JOB_DESCRIPTION.lower():
             skills.append(skill)
     
-    # Generate flowchart
-    _, flowchart_url = generate_mermaid_flowchart(
-        job_title=JOB_TITLE,
-        job_description=JOB_DESCRIPTION,
-        skills_list=skills
-    )
-    
-    # Generate proposal
-    proposal = generate_proposal_with_claude(
-        job_title=JOB_TITLE,
-        job_description=JOB_DESCRIPTION,
-        skills_list=skills,
-        budget=None,  # No budget needed
-        flowchart_url=flowchart_url
-    )
-    
-    # Format message for Telegram
-    message = (
-        f"<b>📋 MANUAL JOB PROCESSING</b>\n\n"
-        f"<b>🔹 {JOB_TITLE}</b>\n\n"
-        f"<b>📝 PROPOSAL:</b>\n{proposal}\n\n"
-        f"<b>📝 FLOWCHART:</b>\n{flowchart_url}\n\n"
-    )
+    # Normalize and compact the description once so both Claude calls share it
+    prepared = prepare_description(JOB_DESCRIPTION, title=JOB_TITLE)
+    
+    try:
+        # Generate flowchart
+        _, flowchart_url = generate_mermaid_flowchart(
+            job_title=JOB_TITLE,
+            job_description=prepared["text"],
+            skills_list=skills
+        )
+        
+        # Generate proposal
+        proposal = generate_proposal_with_claude(
+            job_title=JOB_TITLE,
+            job_description=prepared["text"],
+            skills_list=skills,
+            budget=None,  # No budget needed
+            flowchart_url=flowchart_url
+        )
+    except ClaudeUnavailable as e:
+        logging.error(f"Claude API is overloaded, try again later: {str(e)}")
+        return False
+    
+    # Format message(s) for Telegram, escaping the job and Claude output
+    paragraphs = [f"<b>🔹 {escape(JOB_TITLE)}</b>"]
+    proposal_chunks = [escape(chunk) for chunk in split_text(proposal)]
+    if proposal_chunks:
+        paragraphs.append("<b>📝 PROPOSAL:</b>\n" + proposal_chunks[0])
+        paragraphs.extend(proposal_chunks[1:])
+    if flowchart_url:
+        paragraphs.append(f"<b>📝 FLOWCHART:</b>\n<a href=\"{escape_attr(flowchart_url)}\">Open flowchart in Mermaid Live</a>")
     
     # Send to Telegram
-    result = send_telegram_message(message)
-    if result.get('ok'):
+    results = [send_telegram_message(message) for message in pack_messages([paragraphs], "📋 MANUAL JOB PROCESSING")]
+    if all(result.get('ok') for result in results):
         logging.info("Sent results to Telegram successfully")
         return True
     else:
@@ -372,6 +307,7 @@ def process_job():
 if __name__ == "__main__":
     # Run the processor
     success = process_job()
+    log_tier_stats()
     
     if success:
         print("✅ Job processed and sent to Telegram successfully!")
@@ -0,0 +1,191 @@
+import threading
+import time
+import os
+import logging
+import re
+
+from claude_client import call_claude_message, ClaudeUnavailable
+
+# Model tiers, cheapest first. Prices are USD per million tokens (input, output).
+MODEL_TIERS = {
+    "fast": {
+        "model": os.environ.get("CLAUDE_FAST_MODEL", "claude-3-5-haiku-20241022"),
+        "input_price": 0.80,
+        "output_price": 4.00,
+    },
+    "standard": {
+        "model": os.environ.get("CLAUDE_STANDARD_MODEL", "claude-3-5-sonnet-20240620"),
+        "input_price": 3.00,
+        "output_price": 15.00,
+    },
+}
+
+# Routing policy (override via environment variables)
+HIGH_VALUE_BUDGET = float(os.environ.get("ROUTER_HIGH_VALUE_BUDGET", "1000"))  # USD
+HOURLY_EQUIVALENT_HOURS = float(os.environ.get("ROUTER_HOURLY_HOURS", "40"))  # hours assumed for hourly jobs
+LONG_DESCRIPTION_CHARS = int(os.environ.get("ROUTER_LONG_DESCRIPTION_CHARS", "3000"))
+PRIMARY_TIER_RETRIES = int(os.environ.get("ROUTER_PRIMARY_RETRIES", "2"))  # overload retries before falling back
+
+# max_tokens per task; a three paragraph proposal rarely needs more than ~600
+TOKEN_BUDGETS = {
+    "flowchart": 1500,
+    "proposal": 800,
+    "proposal_high_value": 1000,
+}
+
+
+def is_hourly(payment_type):
+    """
+    Return True if the job's paymentType says it is paid by the hour
+    """
+    return "hourly" in str(payment_type or "").lower()
+
+
+def parse_budget(budget, payment_type=None):
+    """
+    Turn an Upwork budget string ("$1,500.00", "$35.00-$60.00", ...) into an approximate
+    project value in USD. Hourly jobs (per payment_type) are scaled by HOURLY_EQUIVALENT_HOURS;
+    fixed-price amounts are taken as is. Returns None if no amount can be found.
+    """
+    if budget is None:
+        return None
+    if isinstance(budget, (int, float)):
+        amounts = [float(budget)]
+    else:
+        amounts = [float(a.replace(',', '')) for a in re.findall(r'\d[\d,]*(?:\.\d+)?', str(budget))]
+    if not amounts:
+        return None
+
+    value = max(amounts)
+    if is_hourly(payment_type):
+        value *= HOURLY_EQUIVALENT_HOURS
+    return value
+
+
+def route(task, budget=None, description="", payment_type=None):
+    """
+    Pick the model tiers and token budget for a request.
+    Returns (tiers, max_tokens) where tiers is the primary tier followed by fallbacks.
+    """
+    if task == "flowchart":
+        # Flowcharts are structured boilerplate, the fast model handles them fine
+        return ["fast", "standard"], TOKEN_BUDGETS["flowchart"]
+
+    value = parse_budget(budget, payment_type)
+    long_description = len(description or "") > LONG_DESCRIPTION_CHARS
+
+    # Unknown budgets are treated as high value so we don't undersell a good job
+    if value is None or value >= HIGH_VALUE_BUDGET or long_description:
+        return ["standard", "fast"], TOKEN_BUDGETS["proposal_high_value"]
+
+    return ["fast", "standard"], TOKEN_BUDGETS["proposal"]
+
+
+class TierStats:
+    """
+    Thread-safe per-tier counters for latency, tokens and cost. Latency of successful
+    and failed calls is kept apart, so time spent waiting out overloads and backoffs
+    doesn't skew the average used to tune the routing policy.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stats = {}
+
+    def record(self, tier, latency, input_tokens=0, output_tokens=0, ok=True):
+        prices = MODEL_TIERS[tier]
+        cost = (input_tokens * prices["input_price"] + output_tokens * prices["output_price"]) / 1_000_000
+        with self._lock:
+            entry = self.stats.setdefault(tier, {
+                "calls": 0, "failures": 0, "latency": 0.0, "failure_latency": 0.0,
+                "input_tokens": 0, "output_tokens": 0, "cost": 0.0
+            })
+            entry["calls"] += 1
+            if ok:
+                entry["latency"] += latency
+            else:
+                entry["failures"] += 1
+                entry["failure_latency"] += latency
+            entry["input_tokens"] += input_tokens
+            entry["output_tokens"] += output_tokens
+            entry["cost"] += cost
+        return cost
+
+    def summary(self):
+        """
+        Return one human readable line per tier
+        """
+        with self._lock:
+            lines = []
+            for tier, entry in sorted(self.stats.items()):
+                successes = entry["calls"] - entry["failures"]
+                avg_latency = entry["latency"] / successes if successes else 0.0
+                lines.append(
+                    f"{tier} ({MODEL_TIERS[tier]['model']}): {successes}/{entry['calls']} ok, "
+                    f"avg {avg_latency:.1f}s per success, {entry['failures']} failed "
+                    f"({entry['failure_latency']:.1f}s spent on failures), "
+                    f"{entry['input_tokens']} in / {entry['output_tokens']} out tokens, ${entry['cost']:.4f}"
+                )
+            return lines
+
+
+# Shared by every routed call in the process
+tier_stats = TierStats()
+
+
+def log_tier_stats():
+    """
+    Log per-tier latency and cost so the routing policy can be tuned
+    """
+    for line in tier_stats.summary():
+        logging.info(f"Model tier stats - {line}")
+
+
+def call_routed(task, prompt, api_key, budget=None, description="", payment_type=None):
+    """
+    Route a prompt to a model tier and return (text, usage). usage holds the tier,
+    model, latency, token counts and cost of the call that succeeded.
+    Falls back to the next tier when Claude is overloaded; raises ClaudeUnavailable
+    if every tier is overloaded and ClaudeError for any other API error.
+    """
+    tiers, max_tokens = route(task, budget=budget, description=description, payment_type=payment_type)
+
+    for index, tier in enumerate(tiers):
+        model = MODEL_TIERS[tier]["model"]
+        payload = {
+            "model": model,
+            "max_tokens": max_tokens,
+            "messages": [
+                {"role": "user", "content": prompt}
+            ]
+        }
+        is_last = index == len(tiers) - 1
+        logging.info(f"Routing {task} to {tier} tier ({model}, max_tokens={max_tokens})")
+
+        start = time.monotonic()
+        try:
+            if is_last:
+                response_data = call_claude_message(payload, api_key)
+            else:
+                response_data = call_claude_message(payload, api_key, max_retries=PRIMARY_TIER_RETRIES)
+        except ClaudeUnavailable as e:
+            tier_stats.record(tier, time.monotonic() - start, ok=False)
+            if is_last:
+                raise
+            logging.warning(f"{tier} tier unavailable ({str(e)}), falling back to {tiers[index + 1]}")
+            continue
+        latency = time.monotonic() - start
+
+        usage = response_data.get('usage', {})
+        input_tokens = usage.get('input_tokens', 0)
+        output_tokens = usage.get('output_tokens', 0)
+        cost = tier_stats.record(tier, latency, input_tokens, output_tokens)
+
+        return response_data['content'][0]['text'], {
+            "tier": tier,
+            "model": model,
+            "latency": latency,
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "cost": cost,
+        }
@@ -0,0 +1,146 @@
+import unicodedata
+import os
+import logging
+import re
+
+# Descriptions over this many (estimated) tokens get compacted
+PROMPT_TOKEN_BUDGET = int(os.environ.get("PROMPT_TOKEN_BUDGET", "1200"))
+
+# Share of the budget kept from the start of a compacted description; the rest comes from the end
+HEAD_SHARE = 0.75
+
+COMPACTION_MARKER = "[...]"
+
+# Whole lines that carry no information about the job itself
+BOILERPLATE_PATTERNS = [
+    r"^(thanks|thank you)( so much| in advance)?( for (reading|your time|looking|applying))?[.!]*$",
+    r"^(best|kind|warm)? ?regards,?$",
+    r"^(cheers|sincerely|best),?$",
+    r"^looking forward to (hearing from you|working with you|your (proposals?|applications?|response))[.!]*$",
+    r"^(happy|good) (bidding|luck)[.!]*$",
+    r"^no agencies?( please)?[.!]*$",
+    r"^(please )?(do not|don't) (reply|apply) with (a )?(generic|copy[- ]paste[d]?|template[d]?) (proposals?|responses?|messages?)[.!]*$",
+]
+_BOILERPLATE_RE = re.compile("|".join(BOILERPLATE_PATTERNS), re.IGNORECASE)
+
+# Words and single punctuation marks, roughly how BPE tokenizers split text
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+# Sentence boundaries: end punctuation followed by whitespace, or a line break. Decimal
+# points and dotted names ("$1,500.00", "Node.js") have no whitespace after them.
+_SENTENCE_BREAK_RE = re.compile(r"((?<=[.!?])\s+|\s*\n\s*)")
+
+
+def _split_sentences(text):
+    # Returns (sentence, separator) pairs; joining them gives back the original text
+    parts = _SENTENCE_BREAK_RE.split(text)
+    parts.append("")
+    return [(parts[i], parts[i + 1]) for i in range(0, len(parts) - 1, 2) if parts[i]]
+
+
+def count_tokens(text):
+    """
+    Estimate the number of Claude tokens in text without calling the API.
+    Short words count as one token and long words as one per ~5 characters, which
+    tracks Claude's tokenizer closely enough for budgeting and is fully deterministic.
+    """
+    if not text:
+        return 0
+    return sum(max(1, (len(piece) + 4) // 5) for piece in _TOKEN_RE.findall(text))
+
+
+def normalize_text(text):
+    """
+    Normalize unicode, collapse repeated whitespace and drop boilerplate and duplicate lines
+    """
+    if not text:
+        return ""
+    text = unicodedata.normalize("NFKC", text)
+    text = text.replace("\r\n", "\n").replace("\r", "\n")
+
+    lines = []
+    seen = set()
+    for line in text.split("\n"):
+        line = re.sub(r"[ \t]+", " ", line).strip()
+        if line and _BOILERPLATE_RE.match(line):
+            continue
+        # Posts often repeat the same line (copied requirements, signatures)
+        key = line.lower()
+        if line and key in seen:
+            continue
+        if line:
+            seen.add(key)
+        lines.append(line)
+
+    # At most one blank line between paragraphs
+    return re.sub(r"\n{3,}", "\n\n", "\n".join(lines)).strip()
+
+
+def compact_text(text, token_budget=PROMPT_TOKEN_BUDGET):
+    """
+    Deterministically shorten text to roughly token_budget tokens by keeping whole
+    sentences from the start and the end (where requirements and deliverables tend
+    to be) and replacing the middle with a marker
+    """
+    if count_tokens(text) <= token_budget:
+        return text
+
+    sentences = _split_sentences(text)
+    head_budget = int(token_budget * HEAD_SHARE)
+    tail_budget = token_budget - head_budget - count_tokens(COMPACTION_MARKER)
+
+    head = []
+    used = 0
+    for sentence, separator in sentences:
+        tokens = count_tokens(sentence)
+        if used + tokens > head_budget:
+            break
+        head.append(sentence + separator)
+        used += tokens
+
+    tail = []
+    used = 0
+    for sentence, separator in reversed(sentences[len(head):]):
+        tokens = count_tokens(sentence)
+        if used + tokens > tail_budget:
+            break
+        tail.insert(0, sentence + separator)
+        used += tokens
+
+    # A single huge sentence: fall back to cutting on words
+    if not head and not tail:
+        words = text.split()
+        kept = []
+        used = 0
+        for word in words:
+            tokens = count_tokens(word)
+            if used + tokens > token_budget:
+                # Cut an oversized word (URLs, base64 blobs) to the remaining budget
+                kept.append(word[:(token_budget - used) * 5])
+                break
+            kept.append(word)
+            used += tokens
+        return " ".join(kept) + " " + COMPACTION_MARKER
+
+    # Keep the original separators (line breaks in requirement lists included)
+    return "".join(head).rstrip() + "\n" + COMPACTION_MARKER + "\n" + "".join(tail).strip()
+
+
+def prepare_description(description, title="", token_budget=PROMPT_TOKEN_BUDGET):
+    """
+    Normalize and (if needed) compact a job description once so every Claude call for
+    the job can share it. title only labels the log line with the job it belongs to.
+    Returns a dict with the prepared text and the token counts.
+    """
+    original_tokens = count_tokens(description)
+    text = compact_text(normalize_text(description), token_budget)
+    tokens = count_tokens(text)
+
+    prepared = {
+        "text": text,
+        "original_tokens": original_tokens,
+        "tokens": tokens,
+        "compacted": COMPACTION_MARKER in text and COMPACTION_MARKER not in (description or ""),
+    }
+    logging.info(f"Description tokens for '{title or 'No title'}': {original_tokens} -> {tokens}"
+                 f"{' (compacted)' if prepared['compacted'] else ''}")
+    return prepared
@@ -0,0 +1,208 @@
+import threading
+import sqlite3
+import hashlib
+import time
+import uuid
+import os
+import logging
+import json
+
+# SQLite work log (WAL mode) shared by every stage of a scraper run
+CHECKPOINT_DB = os.environ.get("CHECKPOINT_DB", "scraper_checkpoint.db")
+CHECKPOINT_RETENTION_DAYS = float(os.environ.get("CHECKPOINT_RETENTION_DAYS", "7"))
+# Unfinished runs older than this are not resumed automatically; their jobs are no longer
+# "posted in the last hour" and resending them would deliver stale jobs as new
+CHECKPOINT_RESUME_MAX_AGE_MINUTES = float(os.environ.get("CHECKPOINT_RESUME_MAX_AGE_MINUTES", "60"))
+
+# Job states, in pipeline order
+FETCHED = "fetched"
+FLOWCHART_DONE = "flowchart_done"
+PROPOSAL_DONE = "proposal_done"
+DELIVERED = "delivered"
+JOB_STATES = (FETCHED, FLOWCHART_DONE, PROPOSAL_DONE, DELIVERED)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_key TEXT PRIMARY KEY,
+    actor_run_id TEXT,
+    dataset_id TEXT,
+    status TEXT NOT NULL,
+    started_at REAL NOT NULL,
+    finished_at REAL
+);
+CREATE TABLE IF NOT EXISTS jobs (
+    run_key TEXT NOT NULL,
+    job_key TEXT NOT NULL,
+    state TEXT NOT NULL,
+    item_json TEXT NOT NULL,
+    flowchart_url TEXT,
+    proposal TEXT,
+    metadata_json TEXT,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (run_key, job_key)
+);
+"""
+
+
+def job_key(item):
+    """
+    Stable identifier for a scraped job: its link if present, otherwise a hash of the item
+    """
+    if item.get('link'):
+        return item['link']
+    return hashlib.sha1(json.dumps(item, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+class RunCheckpoint:
+    """
+    Crash-safe record of a scraper run, so a re-run after a timeout or crash resumes
+    where the last attempt stopped instead of starting from scratch.
+
+    Every state change is committed immediately to a SQLite database in WAL mode,
+    together with the artifacts produced so far (Apify dataset, flowchart URL,
+    proposal, generation metadata). A resumed run reuses the Apify dataset, skips
+    delivered jobs and only redoes the stages that did not finish.
+
+    The run is identified by run_key, which defaults to CHECKPOINT_RUN_KEY or else
+    GITHUB_RUN_ID, so re-runs of the same Actions workflow run share it. Without either,
+    the most recent unfinished run is resumed if it started less than
+    CHECKPOINT_RESUME_MAX_AGE_MINUTES ago; older unfinished runs are marked abandoned.
+    """
+
+    def __init__(self, path=CHECKPOINT_DB, run_key=None):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        # Databases created before generation metadata was checkpointed
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")]
+        if "metadata_json" not in columns:
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN metadata_json TEXT")
+
+        run_key = run_key or os.environ.get("CHECKPOINT_RUN_KEY") or os.environ.get("GITHUB_RUN_ID")
+        if run_key is None:
+            cutoff = time.time() - CHECKPOINT_RESUME_MAX_AGE_MINUTES * 60
+            stale = self._conn.execute(
+                "UPDATE runs SET status = 'abandoned' WHERE status = 'running' AND started_at < ?", (cutoff,)
+            ).rowcount
+            if stale:
+                logging.info(f"Not resuming {stale} unfinished run(s) older than {CHECKPOINT_RESUME_MAX_AGE_MINUTES:.0f} minutes")
+            row = self._conn.execute(
+                "SELECT run_key FROM runs WHERE status = 'running' ORDER BY started_at DESC LIMIT 1"
+            ).fetchone()
+            run_key = row[0] if row else uuid.uuid4().hex
+
+        self.run_key = run_key
+        row = self._conn.execute("SELECT status FROM runs WHERE run_key = ?", (run_key,)).fetchone()
+        if row is None:
+            self._conn.execute(
+                "INSERT INTO runs (run_key, status, started_at) VALUES (?, 'running', ?)",
+                (run_key, time.time())
+            )
+        else:
+            self._conn.execute("UPDATE runs SET status = 'running' WHERE run_key = ?", (run_key,))
+            logging.info(f"Resuming checkpointed run {run_key}")
+
+    def actor_run(self):
+        """
+        Return (actor_run_id, dataset_id) saved by an earlier attempt, or None
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT actor_run_id, dataset_id FROM runs WHERE run_key = ?", (self.run_key,)
+            ).fetchone()
+        if row and row[1]:
+            return row[0], row[1]
+        return None
+
+    def save_actor_run(self, actor_run_id, dataset_id):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE runs SET actor_run_id = ?, dataset_id = ? WHERE run_key = ?",
+                (actor_run_id, dataset_id, self.run_key)
+            )
+
+    def load_job(self, item):
+        """
+        Return the checkpointed record for a job as a dict (state, flowchart_url, proposal,
+        metadata), recording it as fetched if this is the first time we see it
+        """
+        key = job_key(item)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT state, flowchart_url, proposal, metadata_json FROM jobs WHERE run_key = ? AND job_key = ?",
+                (self.run_key, key)
+            ).fetchone()
+            if row is None:
+                self._conn.execute(
+                    "INSERT INTO jobs (run_key, job_key, state, item_json, updated_at) VALUES (?, ?, ?, ?, ?)",
+                    (self.run_key, key, FETCHED, json.dumps(item, default=str), time.time())
+                )
+                return {"state": FETCHED, "flowchart_url": None, "proposal": None, "metadata": None}
+        return self._record(row)
+
+    def job_records(self):
+        """
+        Return every job checkpointed in this run as {job_key: record}, including work
+        done by earlier attempts of the run
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT job_key, state, flowchart_url, proposal, metadata_json FROM jobs WHERE run_key = ?",
+                (self.run_key,)
+            ).fetchall()
+        return {row[0]: self._record(row[1:]) for row in rows}
+
+    @staticmethod
+    def _record(row):
+        state, flowchart_url, proposal, metadata_json = row
+        return {
+            "state": state,
+            "flowchart_url": flowchart_url,
+            "proposal": proposal,
+            "metadata": json.loads(metadata_json) if metadata_json else None,
+        }
+
+    def _advance(self, item, state, **artifacts):
+        # Never move a job backwards or overwrite its artifacts, e.g. a late flowchart write
+        # after delivery: the row is only touched when the state actually advances
+        columns = "".join(f", {name} = ?" for name in artifacts)
+        with self._lock:
+            self._conn.execute(
+                f"UPDATE jobs SET state = ?, updated_at = ?{columns} "
+                f"WHERE run_key = ? AND job_key = ? AND {self._state_rank('state')} < ?",
+                (state, time.time(), *artifacts.values(), self.run_key, job_key(item), JOB_STATES.index(state))
+            )
+
+    @staticmethod
+    def _state_rank(column):
+        return "CASE " + column + " " + " ".join(
+            f"WHEN '{state}' THEN {rank}" for rank, state in enumerate(JOB_STATES)
+        ) + " END"
+
+    def mark_flowchart(self, item, flowchart_url, metadata):
+        self._advance(item, FLOWCHART_DONE, flowchart_url=flowchart_url, metadata_json=json.dumps(metadata))
+
+    def mark_proposal(self, item, proposal, metadata):
+        self._advance(item, PROPOSAL_DONE, proposal=proposal, metadata_json=json.dumps(metadata))
+
+    def mark_delivered(self, item):
+        self._advance(item, DELIVERED)
+
+    def finish(self):
+        """
+        Mark the run complete and prune finished or abandoned runs past the retention window
+        """
+        cutoff = time.time() - CHECKPOINT_RETENTION_DAYS * 86400
+        with self._lock:
+            self._conn.execute(
+                "UPDATE runs SET status = 'complete', finished_at = ? WHERE run_key = ?",
+                (time.time(), self.run_key)
+            )
+            self._conn.execute(
+                "DELETE FROM jobs WHERE run_key IN (SELECT run_key FROM runs WHERE status != 'running' AND started_at < ?)",
+                (cutoff,)
+            )
+            self._conn.execute("DELETE FROM runs WHERE status != 'running' AND started_at < ?", (cutoff,))
+            self._conn.close()
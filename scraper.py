@@ -5,6 +5,14 @@ import os
 import logging
 import json
 import re
+from concurrent.futures import ThreadPoolExecutor
+
+from claude_client import seconds_until_retry, ClaudeError, ClaudeUnavailable, MAX_CONCURRENCY
+from model_router import call_routed, log_tier_stats
+from prompt_compaction import prepare_description
+from telegram_render import render_job, pack_jobs, pack_messages, split_text, escape, escape_attr, html_to_text, MESSAGE_LIMIT
+from run_checkpoint import RunCheckpoint, FETCHED, FLOWCHART_DONE, DELIVERED
+from job_archive import archive_run
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -16,16 +24,24 @@ TELEGRAM_CHAT_ID = os.environ.get("TELEGRAM_CHAT_ID", "TELEGRAM_BOT_TOKEN")
 CLAUDE_API_KEY = os.environ.get("CLAUDE_API_KEY", "TELEGRAM_BOT_TOKEN")
 client = ApifyClient(token=APIFY_TOKEN)
 
-def generate_mermaid_flowchart(job_title, job_description, skills_list):
+# How many times to retry jobs queued while Claude was overloaded
+RETRY_QUEUE_ROUNDS = int(os.environ.get("RETRY_QUEUE_ROUNDS", "2"))
+
+# Jobs per Telegram delivery. 1 sends every job on its own; larger values turn on digest
+# mode, where that many jobs are packed into as few messages as possible
+BATCH_SIZE = int(os.environ.get("BATCH_SIZE", "1"))
+
+# Sent in place of a proposal when Claude returns an error; never checkpointed as done
+PROPOSAL_ERROR_MESSAGE = "Unable to generate proposal due to API error. Please check logs."
+
+def generate_mermaid_flowchart(job_title, job_description, skills_list, usage_log=None):
     """
     Generate a customized Mermaid flowchart code based on job details using Claude
     Returns the Mermaid code and a shareable URL to view the flowchart
+    If usage_log is a list, the call's model, tokens, latency and cost are appended to it
     """
     logging.info(f"Generating custom flowchart for: {job_title}")
     
-    # Claude API endpoint
-    url = "https://api.anthropic.com/v1/messages"
-    
     # Construct a prompt that asks Claude to generate a Mermaid.js flowchart
     prompt = f"""
     Create a professional Mermaid.js flowchart diagram showing our implementation approach for this job:
@@ -81,63 +97,30 @@ def generate_mermaid_flowchart(job_title, job_description, skills_list):
     ONLY return the Mermaid.js code, nothing else. No explanations or additional text.
     """
     
-    # Set up request headers and payload for Claude API
-    headers = {
-        "x-api-key": CLAUDE_API_KEY,
-        "anthropic-version": "2023-06-01",
-        "content-type": "application/json"
-    }
+    # The router picks the model tier and falls back on overload; ClaudeUnavailable propagates to the caller
+    try:
+        mermaid_code, usage = call_routed("flowchart", prompt, CLAUDE_API_KEY, description=job_description)
+    except ClaudeUnavailable:
+        raise
+    except ClaudeError as e:
+        logging.error(f"Failed to generate Mermaid flowchart: {str(e)}")
+        return None, None
     
-    payload = {
-        "model": "claude-3-5-sonnet-20240620",
-        "max_tokens": 1500,
-        "messages": [
-            {"role": "user", "content": prompt}
-        ]
-    }
+    if usage_log is not None:
+        usage_log.append(dict(usage, task="flowchart"))
     
-    # Retry settings
-    max_retries = 3
-    retry_delay = 5  # seconds
-    current_retry = 0
+    # Clean up the response to extract just the Mermaid code
+    # Remove any markdown code block syntax if present
+    mermaid_code = re.sub(r'```mermaid\s*', '', mermaid_code)
+    mermaid_code = re.sub(r'```\s*$', '', mermaid_code)
+    mermaid_code = mermaid_code.strip()
     
-    while current_retry < max_retries:
-        try:
-            # Make the API call to Claude
-            response = requests.post(url, headers=headers, json=payload)
-            response_data = response.json()
-            
-            # Check for successful response
-            if response.status_code == 200 and 'content' in response_data:
-                mermaid_code = response_data['content'][0]['text']
-                
-                # Clean up the response to extract just the Mermaid code
-                # Remove any markdown code block syntax if present
-                mermaid_code = re.sub(r'```mermaid\s*', '', mermaid_code)
-                mermaid_code = re.sub(r'```\s*$', '', mermaid_code)
-                mermaid_code = mermaid_code.strip()
-                
-                logging.info("Successfully generated custom Mermaid flowchart")
-                
-                # Create a shareable URL using Mermaid Live Editor
-                mermaid_live_url = create_mermaid_live_url(mermaid_code)
-                
-                return mermaid_code, mermaid_live_url
-            
-            # Check specifically for overloaded error
-            elif response_data.get('error', {}).get('type') == 'overloaded_error':
-                current_retry += 1
-                wait_time = retry_delay * current_retry
-                logging.warning(f"Claude API overloaded. Retry {current_retry}/{max_retries} after {wait_time}s")
-                time.sleep(wait_time)
-                continue
-            
-            # Other errors - don't retry
-            else:
-                logging.error(f"Failed to generate Mermaid flowchart: {response_data}")
-                
-        except Exception as e:
-            logging.error(f"Exception calling Claude API: {str(e)}")
+    logging.info("Successfully generated custom Mermaid flowchart")
+    
+    # Create a shareable URL using Mermaid Live Editor
+    mermaid_live_url = create_mermaid_live_url(mermaid_code)
+    
+    return mermaid_code, mermaid_live_url
 
 def create_mermaid_live_url(mermaid_code):
     """
@@ -166,15 +149,13 @@ def create_mermaid_live_url(mermaid_code):
     return mermaid_live_url
 
 # Function to generate proposal with Claude
-def generate_proposal_with_claude(job_title, job_description, skills_list, budget, flowchart_url=None):
+def generate_proposal_with_claude(job_title, job_description, skills_list, budget, flowchart_url=None, usage_log=None, payment_type=None):
     """
     Generate a job proposal using Claude API based on the job details
+    If usage_log is a list, the call's model, tokens, latency and cost are appended to it
     """
     logging.info(f"Generating proposal for: {job_title}")
     
-    # Claude API endpoint
-    url = "https://api.anthropic.com/v1/messages"
-    
     # Add flowchart information to the prompt if available
     flowchart_info = ""
     if flowchart_url:
@@ -219,57 +200,21 @@ def generate_proposal_with_claude(job_title, job_description, skills_list, budge
     Let them know that they will have a team of skilled developers on the project.
     """
     
-    # Set up request headers and payload for Claude API
-    headers = {
-        "x-api-key": CLAUDE_API_KEY,
-        "anthropic-version": "2023-06-01",
-        "content-type": "application/json"
-    }
-    
-    payload = {
-        "model": "claude-3-5-sonnet-20240620",
-        "max_tokens": 1000,
-        "messages": [
-            {"role": "user", "content": prompt}
-        ]
-    }
-    
-    # Retry settings
-    max_retries = 3
-    retry_delay = 5  # seconds
-    current_retry = 0
-    
-    while current_retry < max_retries:
-        try:
-            # Make the API call to Claude
-            response = requests.post(url, headers=headers, json=payload)
-            response_data = response.json()
-            
-            # Check for successful response
-            if response.status_code == 200 and 'content' in response_data:
-                proposal_text = response_data['content'][0]['text']
-                logging.info("Successfully generated proposal with Claude")
-                return proposal_text
-            
-            # Check specifically for overloaded error
-            elif response_data.get('error', {}).get('type') == 'overloaded_error':
-                current_retry += 1
-                wait_time = retry_delay * current_retry
-                logging.warning(f"Claude API overloaded. Retry {current_retry}/{max_retries} after {wait_time}s")
-                time.sleep(wait_time)
-                continue
-            
-            # Other errors - don't retry
-            else:
-                logging.error(f"Failed to generate proposal: {response_data}")
-                return f"Unable to generate proposal due to API error. Please check logs."
-                
-        except Exception as e:
-            logging.error(f"Exception calling Claude API: {str(e)}")
-            return f"Error calling Claude API: {str(e)}"
-    
-    # If we've exhausted all retries
-    return "Could not generate proposal after multiple attempts. Claude API may be experiencing high traffic."
+    # The router picks the model tier and falls back on overload; ClaudeUnavailable propagates to the caller
+    try:
+        proposal_text, usage = call_routed("proposal", prompt, CLAUDE_API_KEY, budget=budget, description=job_description,
+                                             payment_type=payment_type)
+    except ClaudeUnavailable:
+        raise
+    except ClaudeError as e:
+        logging.error(f"Failed to generate proposal: {str(e)}")
+        return PROPOSAL_ERROR_MESSAGE
+    
+    if usage_log is not None:
+        usage_log.append(dict(usage, task="proposal"))
+    
+    logging.info("Successfully generated proposal with Claude")
+    return proposal_text
 
 # Function to send messages to Telegram
 def send_telegram_message(message):
@@ -283,6 +228,16 @@ def send_telegram_message(message):
     try:
         response = requests.post(url, data=payload)
         result = response.json()
+        # Don't lose the message if Telegram can't parse it as HTML: resend as plain text
+        if not result.get('ok') and "can't parse entities" in result.get('description', ''):
+            logging.warning(f"Telegram could not parse HTML, resending as plain text: {result}")
+            del payload["parse_mode"]
+            for chunk in split_text(html_to_text(message), MESSAGE_LIMIT):
+                payload["text"] = chunk
+                response = requests.post(url, data=payload)
+                result = response.json()
+                if not result.get('ok'):
+                    break
         if not result.get('ok'):
             logging.error(f"Telegram error: {result}")
         return result
@@ -290,6 +245,119 @@ def send_telegram_message(message):
         logging.error(f"Exception sending Telegram message: {str(e)}")
         return {"ok": False, "error": str(e)}
 
+def send_job_batch(rendered_jobs, header):
+    """
+    Pack rendered jobs into as few messages as fit under Telegram's limit and send them
+    Returns one bool per job: True if every message holding (part of) that job was delivered
+    """
+    messages, placements = pack_jobs(rendered_jobs, header)
+    sent = []
+    for message in messages:
+        try:
+            result = send_telegram_message(message)
+            sent.append(bool(result.get('ok')))
+        except Exception as e:
+            logging.error(f"Error sending message: {str(e)}")
+            sent.append(False)
+        time.sleep(2)  # Delay to avoid rate limits
+    logging.info(f"Sent {sum(sent)}/{len(messages)} message(s) for {len(rendered_jobs)} job(s)")
+    return [all(sent[index] for index in placement) for placement in placements]
+
+def generate_job_content(item, prepared, skills):
+    """
+    Generate the flowchart and proposal for a single job, reusing any stage already
+    completed in the run checkpoint and recording each stage as it finishes
+    prepared is the job's description from prepare_description, computed once when the
+    job is collected and shared by both Claude calls (and by retry-queue rounds)
+    Returns (flowchart_url, proposal, metadata) where metadata holds the description
+    token counts and the usage of every Claude call made for the job, across attempts
+    Raises ClaudeUnavailable if Claude is overloaded so the job can be queued for retry
+    """
+    record = checkpoint.load_job(item)
+    flowchart_url = record["flowchart_url"]
+    proposal = record["proposal"]
+    
+    # Carry over the usage of stages finished by an earlier attempt of this run
+    metadata = record["metadata"] or {
+        "description_tokens": prepared["original_tokens"] if prepared else None,
+        "prompt_description_tokens": prepared["tokens"] if prepared else None,
+        "usage": []
+    }
+    
+    # Generate a custom flowchart for this specific job
+    if record["state"] == FETCHED:
+        _, flowchart_url = generate_mermaid_flowchart(
+            job_title=item.get('title', 'No title'),
+            job_description=prepared["text"],
+            skills_list=skills,
+            usage_log=metadata["usage"]
+        )
+        if flowchart_url:
+            checkpoint.mark_flowchart(item, flowchart_url, metadata)
+    
+    # Generate a proposal using Claude, including the flowchart link
+    if record["state"] in (FETCHED, FLOWCHART_DONE):
+        proposal = generate_proposal_with_claude(
+            job_title=item.get('title', 'No title'),
+            job_description=prepared["text"],
+            skills_list=skills,
+            budget=item.get('budget', 'Not specified'),
+            payment_type=item.get('paymentType'),
+            flowchart_url=flowchart_url,
+            usage_log=metadata["usage"]
+        )
+        if proposal != PROPOSAL_ERROR_MESSAGE:
+            checkpoint.mark_proposal(item, proposal, metadata)
+    else:
+        logging.info(f"Reusing checkpointed proposal for: {item.get('title', 'No title')}")
+    
+    return flowchart_url, proposal, metadata
+
+def generate_jobs(jobs, retry_queue):
+    """
+    Generate content for the jobs in parallel and yield (job, flowchart_url, proposal, metadata) in order.
+    The per-model limiters decide how many Claude requests are actually in flight. Jobs that
+    fail because Claude is overloaded go into retry_queue and are retried once the circuit
+    breaker allows it; whatever is still left in retry_queue afterwards was not generated.
+    A job that fails for any other reason is logged and skipped; it stays checkpointed at
+    its last finished stage so a re-run picks it up.
+    """
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENCY) as executor:
+        futures = [executor.submit(generate_job_content, job[0], job[3], job[1]) for job in jobs]
+        for job, future in zip(jobs, futures):
+            try:
+                flowchart_url, proposal, metadata = future.result()
+            except ClaudeUnavailable as e:
+                logging.warning(f"Queueing '{job[0].get('title', 'No title')}' for retry: {str(e)}")
+                retry_queue.append(job)
+                continue
+            except Exception as e:
+                # One bad job must not stop delivery, archiving and the checkpoint for the rest
+                logging.error(f"Failed to generate content for '{job[0].get('title', 'No title')}': {str(e)}")
+                continue
+            yield job, flowchart_url, proposal, metadata
+    
+    for retry_round in range(1, RETRY_QUEUE_ROUNDS + 1):
+        if not retry_queue:
+            break
+        wait_time = seconds_until_retry()
+        logging.info(f"Retrying {len(retry_queue)} queued job(s) in {wait_time:.0f}s (round {retry_round}/{RETRY_QUEUE_ROUNDS})")
+        time.sleep(wait_time)
+        
+        pending = retry_queue[:]
+        retry_queue.clear()
+        for job in pending:
+            try:
+                flowchart_url, proposal, metadata = generate_job_content(job[0], job[3], job[1])
+            except ClaudeUnavailable as e:
+                logging.warning(f"'{job[0].get('title', 'No title')}' still queued: {str(e)}")
+                retry_queue.append(job)
+                continue
+            except Exception as e:
+                logging.error(f"Failed to generate content for '{job[0].get('title', 'No title')}': {str(e)}")
+                continue
+            yield job, flowchart_url, proposal, metadata
+
 # Test Telegram connection
 logging.info("Testing Telegram connection...")
 test_result = send_telegram_message("🔄 Upwork scraper starting...")
@@ -308,26 +376,36 @@ run_input = {
     "proxyCountryCode": "US",
 }
 
-# Run the Actor and wait for it to finish
-logging.info("Starting Upwork scraper...")
-run = client.actor("Cvx9keeu3XbxwYF6J").call(run_input=run_input)
-logging.info(f"Scraping complete. Run ID: {run['id']}")
+# Record progress so a crashed or timed out run can be resumed
+checkpoint = RunCheckpoint()
+saved_actor_run = checkpoint.actor_run()
+
+if saved_actor_run:
+    # Reuse the dataset from the interrupted attempt instead of scraping again
+    actor_run_id, dataset_id = saved_actor_run
+    logging.info(f"Reusing Apify run {actor_run_id} from checkpoint")
+else:
+    # Run the Actor and wait for it to finish
+    logging.info("Starting Upwork scraper...")
+    run = client.actor("Cvx9keeu3XbxwYF6J").call(run_input=run_input)
+    logging.info(f"Scraping complete. Run ID: {run['id']}")
+    actor_run_id, dataset_id = run["id"], run["defaultDatasetId"]
+    checkpoint.save_actor_run(actor_run_id, dataset_id)
 
 # Fetch results
 logging.info("Fetching results from Apify...")
-items = list(client.dataset(run["defaultDatasetId"]).iterate_items())
+items = list(client.dataset(dataset_id).iterate_items())
 logging.info(f"Found {len(items)} items from Apify")
 
 # If no items found, send a notification and exit
 if len(items) == 0:
     send_telegram_message("⚠️ Upwork scraper ran but found no new job listings")
+    checkpoint.finish()
     exit(0)
 
-# Send results to Telegram
+# Collect the jobs posted within the last hour
 job_count = 0
-valid_job_count = 0
-batch_size = 1  # Process one job at a time
-job_batch = []
+valid_jobs = []
 
 for item in items:
     job_count += 1
@@ -348,65 +426,86 @@ for item in items:
     
     # Format job details using exact field names from your CSV
     if any(keyword in item.get('publishedDate', '') for keyword in ["minute", "minutes", "1 hour"]):
-        valid_job_count += 1
-
-        # Generate a custom flowchart for this specific job
-        _, flowchart_url = generate_mermaid_flowchart(
-            job_title=item.get('title', 'No title'),
-            job_description=full_description,
-            skills_list=skills
-        )
+        state = checkpoint.load_job(item)["state"]
+        if state == DELIVERED:
+            logging.info(f"Already delivered in an earlier attempt, skipping: {item.get('title', 'No title')}")
+            continue
         
-        # Generate a proposal using Claude, including the flowchart link
-        proposal = generate_proposal_with_claude(
-            job_title=item.get('title', 'No title'),
-            job_description=full_description,
-            skills_list=skills,
-            budget=item.get('budget', 'Not specified'),
-            flowchart_url=flowchart_url
-        )
-        
-        # Include job details with proposal preview and flowchart link
-        job_details = (
-            f"<b>🔹 {item.get('title', 'No title')}</b>\n"
-            f"💰 {item.get('budget', 'N/A')} - {item.get('paymentType', '')}\n"
-            f"📝 {description}\n"
-            f"🗓️ {item.get('publishedDate', 'N/A')}\n"
-            f"🔗 <a href='{item.get('link', '')}'>View Job</a>\n\n"
-            f"<b>📝 PROPOSAL PREVIEW:</b>\n{proposal}\n\n"
-            f"<b>📊 PROJECT FLOWCHART:</b>\n{flowchart_url}"
-        )
-        
-        job_batch.append(job_details)
-        
-        # Send job listing with proposal preview
-        if len(job_batch) >= batch_size:
-            try:
-                message = f"<b>📋 UPWORK JOB LISTING #{valid_job_count}</b>\n\n" + "\n\n".join(job_batch)
-                result = send_telegram_message(message)
-                if result.get('ok'):
-                    logging.info(f"Sent job #{valid_job_count} with proposal preview")
-                else:
-                    logging.error(f"Failed to send job #{job_count}: {result}")
-            except Exception as e:
-                logging.error(f"Error sending message: {str(e)}")
-            job_batch = []
-            time.sleep(2)  # Delay to avoid rate limits
+        # Normalize and compact the description once per job, only if a Claude stage still has to run
+        prepared = None
+        if state in (FETCHED, FLOWCHART_DONE):
+            prepared = prepare_description(full_description, title=item.get('title', 'No title'))
+        valid_jobs.append((item, skills, description, prepared))
     else:
         message = f"Job was posted more than an hour ago! Skipping..."
         logging.info(message)
 
+# Jobs that hit an overloaded Claude API or an open circuit breaker
+retry_queue = []
+
+# Send results to Telegram
+valid_job_count = 0
+job_batch = []
+batch_items = []
+
+for (item, skills, description, _), flowchart_url, proposal, _ in generate_jobs(valid_jobs, retry_queue):
+    valid_job_count += 1
+    
+    # Include job details with proposal preview and flowchart link
+    job_batch.append(render_job(item, description, proposal, flowchart_url))
+    batch_items.append(item)
+    
+    # Send job listing(s) with proposal preview
+    if len(job_batch) >= BATCH_SIZE:
+        if BATCH_SIZE == 1:
+            header = f"📋 UPWORK JOB LISTING #{valid_job_count}"
+        else:
+            header = f"📋 UPWORK JOB DIGEST #{valid_job_count - len(job_batch) + 1}-{valid_job_count}"
+        # Only jobs whose messages all went through count as delivered; the rest are resent on a re-run
+        for sent_item, delivered in zip(batch_items, send_job_batch(job_batch, header)):
+            if delivered:
+                checkpoint.mark_delivered(sent_item)
+            else:
+                logging.error(f"Failed to send job: {sent_item.get('title', 'No title')}")
+        logging.info(f"Sent up to job #{valid_job_count} with proposal preview")
+        job_batch = []
+        batch_items = []
+
 # Send any remaining jobs
 if job_batch:
-    try:
-        message = f"<b>📋 UPWORK JOB LISTING (Final)</b>\n\n" + "\n\n".join(job_batch)
-        result = send_telegram_message(message)
-        if result.get('ok'):
-            logging.info("Sent final job details")
+    for sent_item, delivered in zip(batch_items, send_job_batch(job_batch, "📋 UPWORK JOB DIGEST (Final)")):
+        if delivered:
+            checkpoint.mark_delivered(sent_item)
         else:
-            logging.error(f"Failed to send final job details: {result}")
-    except Exception as e:
-        logging.error(f"Error sending final job message: {str(e)}")
+            logging.error(f"Failed to send job: {sent_item.get('title', 'No title')}")
+    logging.info("Sent final job details")
+
+# List jobs Claude never got to instead of sending them with error text
+if retry_queue:
+    queued_jobs = [
+        [f"• <a href=\"{escape_attr(item.get('link', ''))}\">{escape(item.get('title', 'No title'))}</a>"]
+        for item, _, _, _ in retry_queue
+    ]
+    for message in pack_messages(queued_jobs, f"⏳ Claude API is overloaded. {len(retry_queue)} job(s) could not be processed this run:"):
+        send_telegram_message(message)
+
+# Log per-tier latency and cost for tuning the routing policy
+log_tier_stats()
+
+# Keep every scraped job and its generation metadata for later analysis. Built from the
+# checkpoint so a resumed run also archives what earlier attempts generated and delivered.
+try:
+    archive_run(
+        items,
+        run_key=checkpoint.run_key,
+        job_records=checkpoint.job_records(),
+        search_url=run_input["startUrls"][0]["url"] if len(run_input["startUrls"]) == 1 else ""
+    )
+except Exception as e:
+    logging.error(f"Failed to archive jobs: {str(e)}")
+
+# Jobs still in the retry queue stay checkpointed at their last finished stage
+checkpoint.finish()
 
 # Send summary message
-send_telegram_message(f"✅ Scraping complete! Found {valid_job_count} job listings matching your criteria. Full proposals and custom flowcharts have been shared.")
\ No newline at end of file
+send_telegram_message(f"✅ Scraping complete! Found {valid_job_count} job listings matching your criteria. Full proposals and custom flowcharts have been shared.")
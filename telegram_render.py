@@ -0,0 +1,172 @@
+import html
+import re
+
+# Telegram rejects messages longer than this (counted after HTML entities are parsed)
+MESSAGE_LIMIT = 4096
+
+# Room kept for headers, labels and separators when splitting long text
+SPLIT_MARGIN = 200
+
+# Break points tried in order when a paragraph is too long to send as is
+_SPLIT_SEPARATORS = ["\n\n", "\n", ". ", " "]
+
+# Link URLs longer than this (Mermaid Live flowchart links run to thousands of characters)
+# are dropped from the plain-text fallback, where they would count against MESSAGE_LIMIT
+PLAIN_TEXT_MAX_URL = 300
+
+_TAG_RE = re.compile(r"<[^>]+>")
+_ANCHOR_RE = re.compile(r"<a\s[^>]*href=\"([^\"]*)\"[^>]*>(.*?)</a>", re.IGNORECASE | re.DOTALL)
+
+
+def escape(text):
+    """
+    Escape text for Telegram's HTML parse mode (only <, > and & are special)
+    """
+    return html.escape(str(text), quote=False)
+
+
+def escape_attr(text):
+    """
+    Escape text for use inside a quoted HTML attribute such as href
+    """
+    return html.escape(str(text), quote=True)
+
+
+def visible_length(html_text):
+    """
+    Length Telegram counts against MESSAGE_LIMIT: tags and attributes (including link
+    URLs) don't count and entities count as one character. Measured in UTF-16 code
+    units, like Telegram does, so emoji are not undercounted.
+    """
+    text = html.unescape(_TAG_RE.sub("", html_text))
+    return len(text.encode("utf-16-le")) // 2
+
+
+def split_text(text, limit=MESSAGE_LIMIT - SPLIT_MARGIN):
+    """
+    Split plain (unescaped) text into chunks no longer than limit, preferring
+    paragraph boundaries, then lines, sentences and words. Each separator stays with
+    the text before it, so a sentence split keeps its period.
+    """
+    text = text.strip()
+    if visible_length(escape(text)) <= limit:
+        return [text] if text else []
+
+    for separator in _SPLIT_SEPARATORS:
+        parts = [part for part in re.split(f"(?<={re.escape(separator)})", text) if part]
+        if len(parts) == 1:
+            continue
+        chunks = []
+        current = ""
+        for part in parts:
+            candidate = current + part
+            if visible_length(escape(candidate.rstrip())) <= limit:
+                current = candidate
+                continue
+            if current:
+                chunks.append(current)
+            current = part
+        if current:
+            chunks.append(current)
+        # Any piece still too long gets split on the next, finer separator
+        result = []
+        for chunk in chunks:
+            result.extend(split_text(chunk, limit))
+        return result
+
+    # No separator left (one huge word): hard cut
+    return [text[i:i + limit] for i in range(0, len(text), limit)]
+
+
+def render_job(item, description, proposal, flowchart_url):
+    """
+    Render a job as a list of HTML paragraphs, each safely under MESSAGE_LIMIT.
+    Every scraped field and the Claude output are escaped; the flowchart URL is
+    put in a link so its length doesn't count against the message limit.
+    """
+    link = item.get('link', '')
+    details = (
+        f"<b>🔹 {escape(item.get('title', 'No title'))}</b>\n"
+        f"💰 {escape(item.get('budget', 'N/A'))} - {escape(item.get('paymentType', ''))}\n"
+        f"📝 {escape(description)}\n"
+        f"🗓️ {escape(item.get('publishedDate', 'N/A'))}\n"
+        f"🔗 <a href=\"{escape_attr(link)}\">View Job</a>"
+    )
+
+    paragraphs = [details]
+    proposal_chunks = [escape(chunk) for chunk in split_text(proposal or "")]
+    if proposal_chunks:
+        paragraphs.append("<b>📝 PROPOSAL PREVIEW:</b>\n" + proposal_chunks[0])
+        paragraphs.extend(proposal_chunks[1:])
+
+    if flowchart_url:
+        paragraphs.append(f"<b>📊 PROJECT FLOWCHART:</b>\n<a href=\"{escape_attr(flowchart_url)}\">Open flowchart in Mermaid Live</a>")
+    else:
+        paragraphs.append("<b>📊 PROJECT FLOWCHART:</b>\nNot available")
+
+    return paragraphs
+
+
+def pack_jobs(jobs, header, limit=MESSAGE_LIMIT):
+    """
+    Pack rendered jobs (lists of paragraphs) into as few messages as possible.
+    A job is kept in a single message whenever it fits; a job too long for one
+    message continues in the next message at a paragraph boundary.
+    header is shown in bold on the first message and marked as continued after that.
+    Returns (messages, placements) where placements[i] lists the indices of the
+    messages holding jobs[i].
+    """
+    continued = f"<b>{escape(header)} (cont.)</b>"
+    messages = []
+    placements = []
+    current = f"<b>{escape(header)}</b>"
+    has_content = False
+
+    for paragraphs in jobs:
+        job_text = "\n\n".join(paragraphs)
+        if visible_length(current + "\n\n" + job_text) <= limit:
+            current += "\n\n" + job_text
+            has_content = True
+            placements.append([len(messages)])
+            continue
+
+        # Doesn't fit: start the job in a fresh message and let it flow over if needed
+        if has_content:
+            messages.append(current)
+            current = continued
+            has_content = False
+        placement = [len(messages)]
+        for paragraph in paragraphs:
+            if has_content and visible_length(current + "\n\n" + paragraph) > limit:
+                messages.append(current)
+                current = continued
+                placement.append(len(messages))
+            current += "\n\n" + paragraph
+            has_content = True
+        placements.append(placement)
+
+    messages.append(current)
+    return messages, placements
+
+
+def pack_messages(jobs, header, limit=MESSAGE_LIMIT):
+    """
+    Pack rendered jobs into messages, see pack_jobs
+    """
+    return pack_jobs(jobs, header, limit)[0]
+
+
+def html_to_text(html_text):
+    """
+    Strip tags and entities, for resending a message Telegram could not parse as HTML.
+    Short links (such as the job link) are kept as "text (url)"; longer ones keep only
+    their text. The result can still exceed MESSAGE_LIMIT, so send it through split_text.
+    """
+    def anchor(match):
+        url = html.unescape(match.group(1))
+        if len(url) > PLAIN_TEXT_MAX_URL:
+            return match.group(2)
+        return f"{match.group(2)} ({html.escape(url, quote=False)})"
+
+    text = _ANCHOR_RE.sub(anchor, html_text)
+    return html.unescape(_TAG_RE.sub("", text))